@@ -0,0 +1,304 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from helpers_final import *
+
+##### SYNTHETIC DATA
+
+# Freebase genre labels, roughly in decreasing order of frequency in the CMU corpus
+GENRE_LABELS = ['Drama', 'Comedy', 'Romance Film', 'Black-and-white', 'Action', 'Thriller', 'Short Film', 'World cinema',
+                'Crime Fiction', 'Indie', 'Documentary', 'Horror', 'Silent film', 'Adventure', 'Family Film', 'Action/Adventure',
+                'Comedy film', 'Musical', 'Animation', 'Romantic drama', 'Mystery', 'Science Fiction', 'Fantasy', 'Romantic comedy',
+                'War film', 'Japanese Movies', 'Western', 'Crime Thriller', 'Period piece', 'Comedy-drama', 'Film adaptation',
+                'Chinese Movies', 'Biography', 'Psychological thriller', 'Bollywood', 'Sports', 'Music', 'Family Drama',
+                'Teen', 'LGBT', 'Parody', 'Slapstick', 'Crime Comedy', 'Christmas movie', 'Biographical film', 'History',
+                'Horror Comedy', 'Romantic thriller', 'Political drama', 'Natural horror films', 'Computer Animation',
+                'Biopic [feature]', 'War drama', 'Film noir', 'Disaster', 'Supernatural', 'Stop motion', 'Docudrama']
+
+# Freebase country labels, roughly in decreasing order of frequency in the CMU corpus
+COUNTRY_LABELS = ['United States of America', 'India', 'United Kingdom', 'France', 'Italy', 'Japan', 'Canada', 'Germany',
+                  'Argentina', 'Hong Kong', 'Spain', 'Australia', 'South Korea', 'Mexico', 'Netherlands', 'Sweden',
+                  'Soviet Union', 'Denmark', 'Philippines', 'China', 'Brazil', 'Russia', 'Belgium', 'Egypt', 'Turkey',
+                  'Iran', 'Ireland', 'Norway', 'Poland', 'Finland', 'South Africa', 'Czech Republic', 'Nigeria',
+                  'New Zealand', 'Switzerland', 'Portugal', 'Morocco', 'Cuba', 'West Germany', 'Weimar Republic']
+
+def zipf_weights(n, s=1.1):
+    '''
+    Return normalized Zipf weights for n labels.
+    '''
+    weights = 1 / np.arange(1, n+1)**s
+    return weights / weights.sum()
+
+def freebase_ids(labels, prefix):
+    '''
+    Return a fake but well formed Freebase id ('/m/...') for every label.
+    '''
+    return [f'/m/{prefix}{i:05x}' for i in range(len(labels))]
+
+def make_freebase_strings(rng, n, labels, max_labels, prefix):
+    '''
+    Return n Freebase JSON dict strings, each with 0 to max_labels distinct labels drawn with Zipf weights.
+    '''
+    ids = freebase_ids(labels, prefix)
+    weights = zipf_weights(len(labels))
+    nb_labels = rng.integers(0, max_labels + 1, size=n)
+    picks = rng.choice(len(labels), size=(n, max_labels), p=weights)
+
+    rows = []
+    for k, row in zip(nb_labels, picks):
+        selected = dict.fromkeys(row[:k])  # distinct labels, order kept
+        rows.append(json.dumps({ids[i]: labels[i] for i in selected}))
+    return rows
+
+def make_synthetic_movies(n, seed=0, n_extra_genres=0):
+    '''
+    Return a synthetic dataframe shaped like the CMU 'movie.metadata.tsv' frame with n rows.
+    n_extra_genres rare genres are added to the Freebase genre vocabulary (to go over the 363 genres of the real corpus).
+    '''
+    rng = np.random.default_rng(seed)
+    genre_labels = GENRE_LABELS + [f'Extra genre {i}' for i in range(n_extra_genres)]
+
+    # Release dates with the 3 precisions of the corpus: YYYY, YYYY-MM and YYYY-MM-DD
+    years = rng.integers(1910, 2013, size=n)
+    months = rng.integers(1, 13, size=n)
+    days = rng.integers(1, 29, size=n)
+    precision = rng.choice(3, size=n, p=[0.45, 0.05, 0.5])
+    dates = np.where(precision == 0, years.astype(str),
+                     np.where(precision == 1, [f'{y}-{m:02d}' for y, m in zip(years, months)],
+                              [f'{y}-{m:02d}-{d:02d}' for y, m, d in zip(years, months, days)]))
+
+    revenue = np.where(rng.random(n) < 0.1, rng.lognormal(16, 2, size=n), np.nan)
+
+    return pd.DataFrame({
+        'Wikipedia movieID': np.arange(n),
+        'Freebase movieID': [f'/m/0{i:07x}' for i in range(n)],
+        'Movie name': [f'Movie {i}' for i in range(n)],
+        'Movie release date': dates,
+        'Movie box office revenue': revenue,
+        'Movie runtime': rng.normal(95, 20, size=n).round(),
+        'Movie languages': make_freebase_strings(rng, n, ['English Language', 'French Language', 'Hindi Language'], 2, 'l'),
+        'Movie countries': make_freebase_strings(rng, n, COUNTRY_LABELS, 3, 'c'),
+        'Movie genres': make_freebase_strings(rng, n, genre_labels, 5, 'g'),
+    })
+
+def make_synthetic_matching_frame(n, seed=0, treated_ratio=0.2):
+    '''
+    Return a synthetic frame ready for paired_matching: 'treat', 'Northern_America' and 'Propensity_score' columns.
+    '''
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'treat': (rng.random(n) < treated_ratio).astype(int),
+        'Northern_America': (rng.random(n) < 0.6).astype(int),
+        'Propensity_score': rng.beta(2, 5, size=n),
+    })
+
+##### BENCHMARKS
+
+def time_call(func, *args, **kwargs):
+    '''
+    Return the wall time (in seconds) of one call of func.
+    '''
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+def bench_counting_genres(sizes, reference_max_rows):
+    '''
+    Time counting_genres against counting_genres_iterrows on synthetic frames of the given sizes.
+    The reference is only run up to reference_max_rows rows since it is quadratic.
+    '''
+    results = []
+    for n in sizes:
+        df = make_synthetic_movies(n)
+        new = time_call(counting_genres, df)
+        old = time_call(counting_genres_iterrows, df) if n <= reference_max_rows else np.nan
+        results.append({'rows': n, 'counting_genres [s]': new, 'counting_genres_iterrows [s]': old, 'speedup': old/new})
+    return pd.DataFrame(results)
+
+def bench_paired_matching(sizes, reference_max_rows, caliper=0.05):
+    '''
+    Time the matching methods of paired_matching on synthetic frames of the given sizes.
+    The 'graph' reference is only run up to reference_max_rows rows, and 'hungarian' up to 20000 rows (quadratic memory).
+    '''
+    results = []
+    for n in sizes:
+        df = make_synthetic_matching_frame(n)
+        row = {'rows': n}
+        row['graph [s]'] = time_call(paired_matching, df, method='graph') if n <= reference_max_rows else np.nan
+        row['hungarian [s]'] = time_call(paired_matching, df, method='hungarian') if n <= 20_000 else np.nan
+        row['greedy [s]'] = time_call(paired_matching, df, method='greedy', caliper=caliper)
+        results.append(row)
+    return pd.DataFrame(results)
+
+def bench_parse_freebase_columns(sizes, jobs):
+    '''
+    Time parse_freebase_columns on synthetic frames of the given sizes, for each number of processes in jobs.
+    '''
+    results = []
+    for n in sizes:
+        df = make_synthetic_movies(n)
+        row = {'rows': n}
+        for n_jobs in jobs:
+            row[f'{n_jobs} jobs [s]'] = time_call(parse_freebase_columns, df, n_jobs=n_jobs)
+        results.append(row)
+    return pd.DataFrame(results)
+
+##### HELPER SUITE
+
+def measure(func, args=(), kwargs=None, repeat=3):
+    '''
+    Return the best wall time (in seconds) over repeat calls of func and the peak memory (in MB) allocated during one more call.
+    The prints of the helpers are silenced and their figures closed.
+    '''
+    kwargs = {} if kwargs is None else kwargs
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            times.append(time.perf_counter() - start)
+            plt.close('all')
+
+        # Separate call for the memory: tracemalloc slows the allocations down
+        tracemalloc.start()
+        func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        plt.close('all')
+
+    return min(times), peak / 1e6
+
+def make_helper_inputs(n, seed=0):
+    '''
+    Run the cleaning pipeline of the notebook on a synthetic frame of n rows and return the input of each stage.
+    select_main_years is skipped: the small synthetic frames have less than 200 movies per year.
+    '''
+    raw = make_synthetic_movies(n, seed)
+    dated = dataframe_with_months(select_years(raw))
+    clean = clean_date_and_season(dated.copy())
+    main_genres = main_genres_cluster(GENRES_LEXICAL_FIELD, counting_genres(raw))
+    genres = reshape_genre_column(clean, main_genres)
+    with contextlib.redirect_stdout(io.StringIO()):
+        continents = adding_continents(genres)
+
+    return {'raw': raw, 'dated': dated, 'clean': clean, 'main genres': main_genres, 'genres': genres,
+            'continents': continents, 'matching': make_synthetic_matching_frame(n, seed)}
+
+# Helpers of the suite: name -> function returning the helper and its arguments from the inputs of make_helper_inputs
+HELPER_BENCHMARKS = {
+    'select_years': lambda inputs: (select_years, (inputs['raw'],), {}),
+    'clean_date_and_season': lambda inputs: (clean_date_and_season, (inputs['dated'].copy(),), {}),
+    'counting_genres': lambda inputs: (counting_genres, (inputs['raw'],), {}),
+    'reshape_genre_column': lambda inputs: (reshape_genre_column, (inputs['clean'], inputs['main genres']), {}),
+    'adding_continents': lambda inputs: (adding_continents, (inputs['genres'],), {}),
+    'ttest': lambda inputs: (ttest, (inputs['continents'], 'Drama', [12, 1, 2], None), {}),
+    'ttest_batch': lambda inputs: (ttest_batch, (inputs['continents'], list(GENRES_LEXICAL_FIELD), [[12, 1, 2], [6, 7, 8]]), {}),
+    'resampling_tests': lambda inputs: (resampling_tests, (inputs['continents'], list(GENRES_LEXICAL_FIELD), [[12, 1, 2], [6, 7, 8]]),
+                                        {'n_resamples': 2000}),
+    'balance_report': lambda inputs: (balance_report, (inputs['matching'], ['Propensity_score', 'Northern_America']), {}),
+    'paired_matching': lambda inputs: (paired_matching, (inputs['matching'],), {'method': 'greedy', 'caliper': 0.05}),
+}
+
+def bench_helpers(sizes, helpers=None, repeat=3):
+    '''
+    Time and memory-profile the helpers of HELPER_BENCHMARKS (all of them if None) on synthetic frames of the given sizes.
+    Return one record per (helper, size).
+    '''
+    helpers = list(HELPER_BENCHMARKS) if helpers is None else helpers
+    results = []
+    for n in sizes:
+        inputs = make_helper_inputs(n)
+        for helper in helpers:
+            func, args, kwargs = HELPER_BENCHMARKS[helper](inputs)
+            seconds, peak = measure(func, args, kwargs, repeat)
+            results.append({'helper': helper, 'rows': n, 'seconds': seconds, 'peak memory [MB]': peak})
+    return results
+
+def environment_info():
+    '''
+    Return the versions and machine the benchmarks ran on, saved with the results.
+    '''
+    return {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'machine': platform.machine(), 'processor': platform.processor(),
+            'nb of cpus': os.cpu_count()}
+
+def save_results(results, path):
+    '''
+    Save the benchmark records and the environment to a JSON file.
+    '''
+    with open(path, 'w') as file:
+        json.dump({'environment': environment_info(), 'results': results}, file, indent=2)
+
+def load_results(path):
+    '''
+    Load the benchmark records of a JSON file written by save_results.
+    '''
+    with open(path) as file:
+        return json.load(file)['results']
+
+def compare_results(previous, current, threshold=0.2):
+    '''
+    Compare two runs of bench_helpers on the (helper, rows) they have in common.
+    A helper regressed if its time or its peak memory grew by more than threshold (relative).
+    '''
+    previous = pd.DataFrame(previous).set_index(['helper', 'rows'])
+    current = pd.DataFrame(current).set_index(['helper', 'rows'])
+    both = previous.join(current, how='inner', lsuffix=' before', rsuffix=' now')
+
+    comparison = pd.DataFrame({
+        'time ratio': both['seconds now'] / both['seconds before'],
+        'memory ratio': both['peak memory [MB] now'] / both['peak memory [MB] before'],
+    })
+    comparison['regression'] = (comparison['time ratio'] > 1 + threshold) | (comparison['memory ratio'] > 1 + threshold)
+    return comparison.reset_index()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the helpers on synthetic CMU-shaped frames.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--helpers', nargs='+', choices=list(HELPER_BENCHMARKS), help='helpers of the suite to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed calls of each helper (the best one is kept)')
+    parser.add_argument('--output', help='JSON file where the results of the suite are saved')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare the results with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown or memory growth reported as a regression')
+    parser.add_argument('--references', action='store_true',
+                        help='also compare the optimized helpers with the original implementations')
+    parser.add_argument('--matching-sizes', type=int, nargs='+', default=[200, 1_000, 5_000, 20_000, 100_000])
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4, 8], help='numbers of processes for the parsing benchmark')
+    parser.add_argument('--reference-max-rows', type=int, default=10_000,
+                        help='largest frame on which the original row by row helpers are run')
+    parser.add_argument('--matching-reference-max-rows', type=int, default=1_000,
+                        help='largest frame on which the original networkx matching is run')
+    args = parser.parse_args()
+
+    results = bench_helpers(args.sizes, args.helpers, args.repeat)
+    print(pd.DataFrame(results).to_string(index=False))
+    if args.output is not None:
+        save_results(results, args.output)
+
+    regression = False
+    if args.compare is not None:
+        comparison = compare_results(load_results(args.compare), results, args.threshold)
+        print(comparison.to_string(index=False))
+        regression = comparison['regression'].any()
+
+    if args.references:
+        print(bench_counting_genres(args.sizes, args.reference_max_rows).to_string(index=False))
+        print(bench_paired_matching(args.matching_sizes, args.matching_reference_max_rows).to_string(index=False))
+        print(bench_parse_freebase_columns(args.sizes, args.jobs).to_string(index=False))
+
+    # Non zero exit status on a regression, so that the script can be used as a check
+    sys.exit(1 if regression else 0)
@@ -0,0 +1,145 @@
+import argparse
+import glob
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+##### FIGURE SPECS
+
+# Plotly figure specs (data, layout and config as written by fig.to_json), one per page of the site
+FIGURE_DIR = 'figures'
+# Shared plotly.js bundle, loaded once by the browser for all the figures
+PLOTLY_JS_DIR = 'assets/js'
+
+PAGE_TEMPLATE = '''<html>
+<head><meta charset="utf-8" /></head>
+<body>
+<div id="{div_id}" class="plotly-graph-div" style="height:{height}; width:{width};"></div>
+<script type="text/javascript">window.PlotlyConfig = {{MathJaxConfig: 'local'}};</script>
+<script type="text/javascript" src="{plotly_js}"></script>
+<script type="text/javascript">Plotly.newPlot("{div_id}",{data},{layout},{config});</script>
+</body>
+</html>
+'''
+
+def minified_json(value):
+    '''
+    Return the JSON of value without whitespace, with '<' and '>' escaped so that it can be inlined in a script tag.
+    '''
+    text = json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+    return text.replace('<', '\\u003c').replace('>', '\\u003e')
+
+def extract_plotly_page(html):
+    '''
+    Return the plotly.js bundle (None if the page loads it from a file) and the figure spec (data, layout and config) of a
+    standalone page written by fig.write_html.
+    '''
+    bundle = re.search(r'<script type="text/javascript">(/\*\*\s*\* plotly\.js v.*?)</script>', html, re.S)
+
+    # Arguments of the Plotly.newPlot call of the page (after the bundle): the div id, then the data, layout and config JSON
+    start = re.compile(r'Plotly\.newPlot\(').search(html, bundle.end() if bundle else 0).end()
+    decoder = json.JSONDecoder()
+    values = []
+    for _ in range(4):
+        position = re.compile(r'[\s,]*').match(html, start).end()
+        value, start = decoder.raw_decode(html, position)
+        values.append(value)
+
+    div_id, data, layout, config = values
+    return (bundle.group(1) if bundle else None), {'data': data, 'layout': layout, 'config': config}
+
+def plotly_js_version(bundle):
+    '''
+    Return the version written in the header of a plotly.js bundle.
+    '''
+    return re.search(r'plotly\.js v([\d.]+)', bundle).group(1)
+
+def extract_figures(pages, figure_dir=FIGURE_DIR, plotly_js_dir=PLOTLY_JS_DIR):
+    '''
+    Save the figure spec of each standalone page to figure_dir and its most recent plotly.js bundle to plotly_js_dir.
+    Return the path of the bundle.
+    '''
+    os.makedirs(figure_dir, exist_ok=True)
+    bundles = {}
+    for page in pages:
+        with open(page, encoding='utf-8') as file:
+            bundle, spec = extract_plotly_page(file.read())
+        if bundle is not None:
+            bundles[plotly_js_version(bundle)] = bundle
+
+        name = os.path.splitext(os.path.basename(page))[0]
+        with open(os.path.join(figure_dir, name + '.json'), 'w', encoding='utf-8') as file:
+            file.write(minified_json(spec))
+
+    # plotly.js 2.x is backward compatible: the most recent bundle draws all the figures
+    version = max(bundles, key=lambda v: tuple(map(int, v.split('.'))))
+    os.makedirs(plotly_js_dir, exist_ok=True)
+    plotly_js = os.path.join(plotly_js_dir, f'plotly-{version}.min.js')
+    with open(plotly_js, 'w', encoding='utf-8') as file:
+        file.write(bundles[version])
+
+    return plotly_js
+
+##### RENDERING
+
+def render_page(spec, plotly_js, div_id):
+    '''
+    Return the HTML page of a figure spec, loading plotly.js from plotly_js. As fig.write_html, the div takes the height and
+    the width of the layout, and the whole page otherwise.
+    '''
+    layout = spec.get('layout', {})
+    height = f"{layout['height']}px" if 'height' in layout else '100%'
+    width = f"{layout['width']}px" if 'width' in layout else '100%'
+
+    return PAGE_TEMPLATE.format(div_id=div_id, height=height, width=width, plotly_js=plotly_js, data=minified_json(spec['data']),
+                                layout=minified_json(layout), config=minified_json(spec.get('config', {})))
+
+def render_figure(figure_path, output_dir, plotly_js):
+    '''
+    Render the spec figure_path to output_dir, with the same name, and return the path and size of the page.
+    '''
+    name = os.path.splitext(os.path.basename(figure_path))[0]
+    with open(figure_path, encoding='utf-8') as file:
+        spec = json.load(file)
+
+    # Relative path, so that the site works under any base url
+    page_path = os.path.join(output_dir, name + '.html')
+    src = os.path.relpath(plotly_js, output_dir).replace(os.sep, '/')
+    page = render_page(spec, src, re.sub(r'\W', '-', name))
+
+    with open(page_path, 'w', encoding='utf-8') as file:
+        file.write(page)
+    return page_path, len(page.encode('utf-8'))
+
+def build_figures(figure_dir=FIGURE_DIR, output_dir='.', plotly_js=None, n_jobs=None):
+    '''
+    Render all the figure specs of figure_dir to output_dir, over a pool of n_jobs processes (one per cpu if None).
+    Return the size of each page.
+    '''
+    figures = sorted(glob.glob(os.path.join(figure_dir, '*.json')))
+    if plotly_js is None:
+        plotly_js = sorted(glob.glob(os.path.join(PLOTLY_JS_DIR, 'plotly-*.min.js')))[-1]
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        pages = list(executor.map(render_figure, figures, [output_dir] * len(figures), [plotly_js] * len(figures)))
+
+    return dict(pages)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the plotly pages of the site from the figure specs, with a shared plotly.js.")
+    parser.add_argument('--extract', nargs='+', metavar='PAGE',
+                        help='standalone pages (written by fig.write_html) to turn into figure specs before the build')
+    parser.add_argument('--figure-dir', default=FIGURE_DIR)
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--jobs', type=int, default=None, help='number of processes (default: one per cpu)')
+    args = parser.parse_args()
+
+    plotly_js = None
+    if args.extract is not None:
+        plotly_js = extract_figures(args.extract, args.figure_dir)
+
+    pages = build_figures(args.figure_dir, args.output_dir, plotly_js, args.jobs)
+    for page, size in pages.items():
+        print(f'{page}: {size / 1e3:.1f} kB')
+    print(f'{len(pages)} pages, {sum(pages.values()) / 1e6:.2f} MB without the shared plotly.js')
@@ -1,42 +1,331 @@
+import argparse
+import calendar
+import functools
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
 import dash
+import numpy as np
+import pandas as pd
+import scipy.stats
 from dash import dcc, html
-from dash.dependencies import Input, Output
-import time
+from dash.dependencies import Input, Output, State
+from flask import abort, jsonify
+
+# Résultats précalculés (python decompte.py precompute), servis par /results
+RESULTS_PATH = 'Data/results.json'
+# Cube agrégé des films (helpers_final.build_aggregate_cube), chargé au démarrage par l'explorateur
+CUBE_PATH = 'Data/cube.parquet'
+# Genre affiché au départ par l'explorateur, s'il est dans le cube
+DEFAULT_GENRE = 'Horror'
+
+# Valeur de départ du compte à rebours et texte affiché à la fin
+COUNTDOWN_START = 5
+FINAL_TEXT = "La valeur est : 27"
+
+# Études du notebook : genre, mois traités, première année considérée, et appariement (propensity score) ou non
+STUDIES = {
+    'horror': {'genre': 'Horror', 'months': [10], 'year split': 1980, 'matching': True},
+    'family': {'genre': 'Family film', 'months': [7, 11, 12], 'year split': 1930, 'matching': True},
+    'romance': {'genre': 'Romance', 'months': [2], 'year split': 1980, 'matching': False},
+}
+
+# Continents de l'explorateur et leur code dans 'continent_1' (helpers_final.CONTINENT_DIGITS)
+CONTINENTS = {'All': None, 'Northern America': 1, 'Europe': 2, 'South America': 3, 'Asia': 4, 'Africa': 5}
+
+##### PRÉCALCUL DES RÉSULTATS
+
+def matched_pairs_stats(genre_movies):
+    '''
+    Apparie les films traités aux films de contrôle du genre (sortie de propensity_scores), comme dans le notebook,
+    et renvoie la moyenne et l'écart type du box office et du budget de chaque groupe après appariement.
+    '''
+    from helpers_final import paired_matching
+
+    # Les films dont une covariable manque n'ont pas de propensity score
+    genre_movies = genre_movies[genre_movies['Propensity_score'].notna()]
+    balanced_df, balanced_treatment, balanced_control = paired_matching(genre_movies)
+
+    stats = {'nb of pairs': len(balanced_treatment)}
+    for group, movies in [('treatment', balanced_treatment), ('control', balanced_control)]:
+        for column in ['Movie box office revenue', 'budget']:
+            stats[f'{group} {column} mean'] = float(movies[column].mean())
+            stats[f'{group} {column} std'] = float(movies[column].std())
+    return stats
+
+def compute_results(df_movies, df_merged, studies=STUDIES):
+    '''
+    Calcule les résultats de chaque étude : le t-test du notebook (ttest_batch) et, si demandé, les statistiques des paires
+    appariées sur les films dont le budget est connu (df_merged).
+    '''
+    from helpers_final import propensity_scores, ttest_batch
+
+    # Propensity scores de toutes les études avec appariement, estimés ensemble
+    treatments = [(study['genre'], study['months']) for study in studies.values() if study['matching']]
+    scores = propensity_scores(df_merged, treatments)
+
+    results = {}
+    for name, study in studies.items():
+        tests = ttest_batch(df_movies, [study['genre']], [study['months']], [study['year split']])
+        result = json.loads(tests.to_json(orient='records'))[0]
+        if study['matching']:
+            result['matched pairs'] = matched_pairs_stats(scores[(study['genre'], tuple(study['months']))])
+        results[name] = result
+    return results
+
+def precompute(path=RESULTS_PATH, cube_path=CUBE_PATH):
+    '''
+    Charge les films nettoyés (cache de helpers_final), écrit leur cube agrégé dans cube_path, calcule les résultats et les
+    écrit dans path.
+    '''
+    from helpers_final import BUDGET_PATH, build_aggregate_cube, load_clean_movies, prepare_budget, write_cached_frame
+
+    df_movies = load_clean_movies()
+    write_cached_frame(build_aggregate_cube(df_movies).reset_index(), cube_path)
+    df_budget = prepare_budget(pd.read_csv(BUDGET_PATH, usecols=['id', 'budget', 'original_title', 'release_date', 'runtime']))
+    df_merged = df_movies.merge(df_budget.drop(columns=['Movie runtime']), on=['Movie name', 'Movie release year'])
+    # Comme dans le notebook, les films sans pays de sortie connu sont retirés
+    df_merged = df_merged.dropna(subset=['continent_1'])
+    # Budget en nombre (lu comme texte dans le CSV), puis seulement les films dont le budget est connu, comme dans le notebook
+    df_merged['budget'] = df_merged['budget'].astype(float)
+    df_merged = df_merged[df_merged['budget'] != 0]
+
+    results = compute_results(df_movies, df_merged)
+
+    # Écriture atomique : les workers ne lisent jamais un fichier à moitié écrit
+    with open(path + '.tmp', 'w') as file:
+        json.dump(results, file, indent=2)
+    os.replace(path + '.tmp', path)
+    return results
+
+##### INDEX DE L'EXPLORATEUR
+
+def explorer_index(cube):
+    '''
+    Construit l'index de l'explorateur à partir du cube agrégé : le nombre de films de chaque genre principal 'counts'
+    (continent, année, mois, genre) et le nombre total de films 'totals' (continent, année, mois), avec les années 'years' et
+    les genres 'genres'. Le continent 0 regroupe les films dont le continent est inconnu, les continents 1 à 5 suivent
+    CONTINENT_DIGITS.
+    '''
+    from helpers_final import melt_cube_genres
+
+    cells = cube.reset_index()
+    years = np.sort(cells['Movie release year'].unique())
+    year_codes = np.searchsorted(years, cells['Movie release year'])
+    continent_codes = pd.to_numeric(cells['continent_1'].astype(object), errors='coerce').fillna(0).to_numpy(dtype=int)
+    month_codes = cells['Movie release month'].to_numpy(dtype=int) - 1
+
+    totals = np.zeros((len(CONTINENTS), len(years), 12), dtype=np.int64)
+    np.add.at(totals, (continent_codes, year_codes, month_codes), cells['nb of movies'].to_numpy())
+
+    # Un film compte une fois pour chacun de ses genres principaux
+    melted = melt_cube_genres(cube, ['nb of movies', 'continent_1'])
+    genre_codes, genres = pd.factorize(melted['genre'], sort=True)
+    counts = np.zeros((len(CONTINENTS), len(years), 12, len(genres)), dtype=np.int64)
+    np.add.at(counts, (pd.to_numeric(melted['continent_1'].astype(object), errors='coerce').fillna(0).to_numpy(dtype=int),
+                       np.searchsorted(years, melted['Movie release year']),
+                       melted['Movie release month'].to_numpy(dtype=int) - 1, genre_codes), melted['nb of movies'].to_numpy())
+
+    return {'counts': counts, 'totals': totals, 'years': years, 'genres': list(genres)}
+
+def load_explorer_index(cube_path=CUBE_PATH):
+    '''
+    Charge le cube écrit par precompute et construit l'index de l'explorateur (None si le cube n'existe pas).
+    '''
+    from helpers_final import CUBE_LEVELS, read_cached_frame
+
+    if not os.path.exists(cube_path):
+        return None
+    return explorer_index(read_cached_frame(cube_path).set_index(CUBE_LEVELS))
+
+def default_genre(index):
+    '''
+    Genre affiché au départ : DEFAULT_GENRE s'il est dans l'index, sinon le premier genre disponible (None sans genre).
+    '''
+    if index is None or len(index['genres']) == 0:
+        return None
+    return DEFAULT_GENRE if DEFAULT_GENRE in index['genres'] else index['genres'][0]
+
+def explore(index, genre, split_year, months, continent):
+    '''
+    Réponse de l'explorateur, calculée sur l'index seulement : le nombre de films du genre par année, par mois et leur part
+    des films de chaque mois après split_year, et le t-test de ttest (moyenne mensuelle par année dans months et hors de months).
+    '''
+    code = CONTINENTS[continent]
+    counts = index['counts'].sum(axis=0) if code is None else index['counts'][code]
+    totals = index['totals'].sum(axis=0) if code is None else index['totals'][code]
+    genre_counts = counts[:, :, index['genres'].index(genre)]
+    after = index['years'] >= split_year
+
+    in_months = np.isin(np.arange(1, 13), months)
+    by_year_in = genre_counts[after][:, in_months].sum(axis=1)
+    by_year_not_in = genre_counts[after][:, ~in_months].sum(axis=1)
+    # Comme le groupby de ttest, seules les années avec au moins un film comptent
+    ttest = scipy.stats.ttest_ind(np.round(by_year_in[by_year_in > 0] / in_months.sum()),
+                                  np.round(by_year_not_in[by_year_not_in > 0] / (~in_months).sum()))
+
+    return {'per year': genre_counts.sum(axis=1), 'per month': genre_counts[after].sum(axis=0),
+            'ratio per month': genre_counts[after].sum(axis=0) / np.maximum(totals[after].sum(axis=0), 1),
+            'p-value': float(ttest.pvalue)}
+
+def explorer_figures(index, genre, split_year, months, continent):
+    '''
+    Figures (dictionnaires plotly) et texte de l'explorateur, les mois choisis en orange.
+    '''
+    answer = explore(index, genre, split_year, months, continent)
+    month_names = list(calendar.month_abbr[1:])
+    colors = ['orange' if month in months else 'steelblue' for month in range(1, 13)]
+
+    per_year = {'data': [{'type': 'scatter', 'x': index['years'].tolist(), 'y': answer['per year'].tolist(), 'mode': 'lines'}],
+                'layout': {'title': f'Number of {genre} movies in every year', 'height': 300}}
+    per_month = {'data': [{'type': 'bar', 'x': month_names, 'y': answer['per month'].tolist(), 'marker': {'color': colors}}],
+                 'layout': {'title': f'Number of {genre} movie per month after {split_year}', 'height': 300}}
+    ratio = {'data': [{'type': 'bar', 'x': month_names, 'y': answer['ratio per month'].tolist(), 'marker': {'color': colors}}],
+             'layout': {'title': f'Ratio of {genre} movie per month after {split_year}', 'height': 300}}
+
+    rejected = 'rejected' if answer['p-value'] < 0.05 else 'not rejected'
+    text = f"p-value of the t-test: {answer['p-value']:.6f}, the null hypothesis is {rejected}."
+    return per_year, per_month, ratio, text
+
+##### SERVEUR
+
+@functools.lru_cache(maxsize=8)
+def load_results(path, mtime):
+    '''
+    Lit les résultats précalculés. Le cache est propre à chaque worker et indexé par la date de modification du fichier,
+    un nouveau précalcul est donc pris en compte sans redémarrer le serveur.
+    '''
+    with open(path) as file:
+        return json.load(file)
+
+def current_results(path=RESULTS_PATH):
+    if not os.path.exists(path):
+        abort(503, description='Results not precomputed, run: python decompte.py precompute')
+    return load_results(path, os.path.getmtime(path))
+
+# Index chargé une fois au démarrage de chaque worker, en lecture seule ensuite
+INDEX = load_explorer_index()
 
 app = dash.Dash(__name__)
+# Application WSGI pour gunicorn : gunicorn -w 4 decompte:server
+server = app.server
+
+@server.route('/results')
+def results_endpoint():
+    return jsonify(current_results())
 
-# Layout de l'application
+@server.route('/results/<study>')
+def study_endpoint(study):
+    results = current_results()
+    if study not in results:
+        abort(404)
+    return jsonify(results[study])
+
+# Layout de l'application : l'état du compte à rebours est propre à chaque session (dcc.Store), le serveur n'en garde aucun
 app.layout = html.Div([
     html.Div(id='output-container', style={'margin-top': 20, 'font-size': 24}),
+    dcc.Store(id='countdown-store', storage_type='session', data={'remaining': COUNTDOWN_START}),
     dcc.Interval(
         id='interval-component',
         interval=1000,  # en millisecondes, mettez à jour toutes les secondes
         n_intervals=0
     ),
+    # Explorateur : genre, année de séparation, mois et continent
+    html.Div([
+        dcc.Dropdown(id='genre-dropdown', options=INDEX['genres'] if INDEX else [], value=default_genre(INDEX),
+                     clearable=False),
+        dcc.Dropdown(id='split-year-dropdown', options=list(range(1910, 2011, 10)), value=1980, clearable=False),
+        dcc.Dropdown(id='months-dropdown', multi=True, value=[10],
+                     options=[{'label': calendar.month_name[month], 'value': month} for month in range(1, 13)]),
+        dcc.Dropdown(id='continent-dropdown', options=list(CONTINENTS), value='All', clearable=False),
+    ], style={'display': 'grid', 'grid-template-columns': 'repeat(4, 1fr)', 'gap': 10, 'margin-top': 20}),
+    html.Div(id='ttest-container', style={'margin-top': 10}),
+    dcc.Graph(id='per-year-graph'),
+    dcc.Graph(id='per-month-graph'),
+    dcc.Graph(id='ratio-graph'),
 ])
 
-# Données initiales
-countdown_value = 5
+# Compte à rebours exécuté dans le navigateur : aucun aller-retour vers le serveur à chaque seconde
+app.clientside_callback(
+    '''
+    function(n_intervals, data) {
+        var remaining = Math.max(data.remaining - (n_intervals > 0 ? 1 : 0), 0);
+        if (remaining === 0) {
+            return [FINAL_TEXT, {remaining: 0}, true];
+        }
+        return ["La valeur sera révélée dans " + remaining + " secondes.", {remaining: remaining}, false];
+    }
+    '''.replace('FINAL_TEXT', json.dumps(FINAL_TEXT)),
+    Output('output-container', 'children'),
+    Output('countdown-store', 'data'),
+    Output('interval-component', 'disabled'),
+    Input('interval-component', 'n_intervals'),
+    State('countdown-store', 'data'),
+)
 
-# Fonction de mise à jour appelée à chaque intervalle
+# L'explorateur répond depuis l'index, jamais depuis les films
 @app.callback(
-    Output('output-container', 'children'),
-    [Input('interval-component', 'n_intervals')]
+    Output('per-year-graph', 'figure'),
+    Output('per-month-graph', 'figure'),
+    Output('ratio-graph', 'figure'),
+    Output('ttest-container', 'children'),
+    Input('genre-dropdown', 'value'),
+    Input('split-year-dropdown', 'value'),
+    Input('months-dropdown', 'value'),
+    Input('continent-dropdown', 'value'),
 )
-def update_layout(n_intervals):
-    global countdown_value
+def update_explorer(genre, split_year, months, continent):
+    if INDEX is None:
+        return {}, {}, {}, 'Aggregate cube not precomputed, run: python decompte.py precompute'
+    if genre not in INDEX['genres']:
+        return {}, {}, {}, 'No movie of this genre in the aggregate cube.'
+    if not months or len(months) == 12:
+        return dash.no_update, dash.no_update, dash.no_update, 'Select between 1 and 11 months.'
+    return explorer_figures(INDEX, genre, split_year, months, continent)
 
-    if countdown_value > 0:
-        countdown_value -= 1
+##### TEST DE CHARGE
 
-    # Mise à jour du texte dans la div
-    output_text = f"La valeur sera révélée dans {countdown_value} secondes."
+def timed_get(url):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    return status, time.perf_counter() - start
 
-    # Si le compte à rebours est terminé, affichez la valeur finale
-    if countdown_value == 0:
-        output_text = "La valeur est : 27"
+def load_test(url, nb_requests=1000, concurrency=16):
+    '''
+    Envoie nb_requests requêtes GET sur url depuis concurrency clients, et renvoie le débit et les latences.
+    '''
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        responses = list(executor.map(timed_get, [url] * nb_requests))
+    duration = time.perf_counter() - start
 
-    return output_text
+    statuses = np.array([status for status, _ in responses])
+    latencies = np.array([latency for _, latency in responses]) * 1000
+    return {'nb of requests': nb_requests, 'nb of errors': int((statuses != 200).sum()),
+            'requests per second': nb_requests / duration, 'median latency [ms]': float(np.median(latencies)),
+            'p99 latency [ms]': float(np.percentile(latencies, 99))}
 
 if __name__ == '__main__':
-    app.run_server(debug=True, port=8051)
+    parser = argparse.ArgumentParser(description='Serveur des résultats du projet.')
+    parser.add_argument('command', nargs='?', default='serve', choices=['serve', 'precompute', 'load-test'])
+    parser.add_argument('--port', type=int, default=8051)
+    parser.add_argument('--url', default='http://127.0.0.1:8051/results', help='url du test de charge')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    if args.command == 'precompute':
+        precompute()
+    elif args.command == 'load-test':
+        print(load_test(args.url, args.requests, args.concurrency))
+    else:
+        app.run_server(debug=True, port=args.port)